@@ -1,29 +1,45 @@
 import streamlit as st
 
-from services.pinecone_service import PineconeService
-from services.openai_service import OpenAIService
 from components.document_list import render_document_list
 from components.chat_interface import render_chat_interface
 from utils.session_state import init_session_state
-from components.chat_interface import render_chat_interface
 
 # Configuración inicial de la página
 st.set_page_config(layout="wide", page_title="PDF Chatbot")
 
+@st.cache_resource(show_spinner=False)
+def get_openai_service():
+    """Crea el servicio de OpenAI una sola vez por proceso y precarga los tokenizadores"""
+    # Importaciones diferidas: los SDKs pesados solo se cargan en el primer arranque
+    from services.openai_service import OpenAIService
+    from utils.token_counter import warm_up_encodings
+
+    warm_up_encodings()
+    return OpenAIService(
+        api_base=st.secrets["AZURE_OPENAI_API_BASE"],
+        api_key=st.secrets["AZURE_OPENAI_API_KEY"],
+        embed_model=st.secrets["EMBED_MODEL"]
+    )
+
+@st.cache_resource(show_spinner=False)
+def get_pinecone_service():
+    """Crea el servicio de Pinecone (y su handle de índice) una sola vez por proceso"""
+    from services.pinecone_service import PineconeService
+
+    return PineconeService(api_key=st.secrets["PINECONE_API_KEY"])
+
 # Inicializar estado de la sesión
 init_session_state()
 
-# Inicializar servicios
+# Inicializar servicios (compartidos entre sesiones, creación casi gratuita)
 if 'openai_service' not in st.session_state:
-    st.session_state.openai_service = OpenAIService(
-        api_base=st.secrets["AZURE_OPENAI_API_BASE"],
-        api_key=st.secrets["AZURE_OPENAI_API_KEY"]
-    )
+    st.session_state.openai_service = get_openai_service()
 
 if 'pinecone_service' not in st.session_state:
-    st.session_state.pinecone_service = PineconeService(
-        api_key=st.secrets["PINECONE_API_KEY"]
-    )
+    st.session_state.pinecone_service = get_pinecone_service()
+    if st.session_state.pinecone_service.index is None:
+        # No cachear una inicialización fallida: se reintenta en la siguiente sesión
+        get_pinecone_service.clear()
 
 # Obtener documentos disponibles
 documents = st.session_state.pinecone_service.get_available_documents()
@@ -34,4 +50,4 @@ render_chat_interface(
     documents, 
     st.session_state.pinecone_service, 
     st.session_state.openai_service
-)
\ No newline at end of file
+)
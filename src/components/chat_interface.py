@@ -1,5 +1,15 @@
 import streamlit as st
 from utils.token_counter import count_tokens, count_messages_tokens
+from utils.conversation_memory import get_history_messages, schedule_summary_update
+from services.client_policy import METRICS
+
+# Instrucciones del modo NO_RAG; deben ser constantes para no romper el prefijo cacheable
+NO_RAG_SYSTEM_MESSAGE = (
+    "Eres un asistente experto que analiza y responde preguntas sobre documentos. "
+    "A continuación se te proporcionará el contenido completo de un documento. "
+    "Debes basar todas tus respuestas únicamente en la información de este documento. "
+    "Si la información no está en el documento, indícalo claramente."
+)
 
 def render_chat_interface(documents, pinecone_service, openai_service):
     """Renderiza la interfaz principal del chat"""
@@ -10,10 +20,21 @@ def render_chat_interface(documents, pinecone_service, openai_service):
             st.toggle("🐛 Modo Debug", key="debug_mode")
         
         render_active_chat(documents, pinecone_service, openai_service)
+        if st.session_state.debug_mode:
+            render_client_metrics()
     else:
         st.title("PDF Chatbot")
         st.info("👈 Selecciona o sube un documento en el panel lateral para comenzar a chatear")
 
+def render_client_metrics():
+    """Muestra en modo debug las métricas de reintentos, timeouts y hedges de los clientes"""
+    metrics = METRICS.snapshot()
+    if not metrics:
+        return
+    with st.expander("📈 Métricas de clientes"):
+        for name, counters in sorted(metrics.items()):
+            st.caption(f"{name}: " + " · ".join(f"{key} {value}" for key, value in sorted(counters.items())))
+
 def render_active_chat(documents, pinecone_service, openai_service):
     """Renderiza el chat cuando hay un documento activo"""
     doc_info = documents.get(st.session_state.active_doc, {})
@@ -23,7 +44,7 @@ def render_active_chat(documents, pinecone_service, openai_service):
     
     col1, col2, col3 = st.columns([2, 2, 3])
     with col1:
-        st.caption(f"📅 Subido: {doc_info.get('upload_date', 'Desconocido')}")
+        st.caption(f"📅 Subido: {doc_info.get('upload_date', 'Desconocido')} (v{doc_info.get('version', 1)})")
     with col2:
         st.caption(f"📄 Páginas: {doc_info.get('num_pages', 'Desconocido')}")
     with col3:
@@ -64,7 +85,7 @@ def handle_rag_mode(user_input, doc_info, pinecone_service, openai_service):
         st.write("1. Generando embedding para la pregunta...")
 
     question_embedding = openai_service.get_embedding(user_input)
-    if question_embedding:
+    if question_embedding is not None:
         # Debug info - Embedding generado
         if st.session_state.debug_mode:
             st.write(f"✓ Embedding generado (dimensión: {len(question_embedding)})")
@@ -109,12 +130,15 @@ def handle_rag_mode(user_input, doc_info, pinecone_service, openai_service):
                 input_tokens = count_messages_tokens(messages)
                 st.write("4. Preparando prompt para GPT:")
                 st.write(f"✓ Total tokens en el prompt: {input_tokens}")
+                st.write(f"✓ Mensajes resumidos: {st.session_state.summarized_messages}")
                 with st.expander("Ver prompt completo"):
                     st.write("Mensajes del sistema:")
                     for msg in messages[:2]:  # Los primeros dos mensajes son del sistema
                         st.text(msg['content'])
             
             generate_response(messages, openai_service)
+            # Comprimir en segundo plano los mensajes que ya no son recientes
+            schedule_summary_update(openai_service)
     elif st.session_state.debug_mode:
         st.error("❌ Error: No se pudo generar el embedding para la pregunta")
 
@@ -144,36 +168,16 @@ def handle_no_rag_mode(user_input, doc_info, openai_service, pinecone_service):
         st.error("No se pudo recuperar el contenido del documento.")
         return
     
-    # Crear mensajes para el chat
-    system_message = (
-        "Eres un asistente experto que analiza y responde preguntas sobre documentos. "
-        "A continuación se te proporcionará el contenido completo de un documento. "
-        "Debes basar todas tus respuestas únicamente en la información de este documento. "
-        "Si la información no está en el documento, indícalo claramente."
-    )
-    
-    content_message = f"""
-A continuación está el contenido completo del documento:
-
----INICIO DEL DOCUMENTO---
-{doc_content}
----FIN DEL DOCUMENTO---
-
-La pregunta del usuario es: {user_input}
-
-Responde usando ÚNICAMENTE la información proporcionada en el documento anterior.
-"""
-    
-    messages = [
-        {
-            "role": "system",
-            "content": system_message
-        },
-        {
-            "role": "user",
-            "content": content_message
-        }
-    ]
+    # Crear mensajes para el chat: instrucciones y documento forman un prefijo
+    # idéntico en cada pregunta (cacheable por el proveedor) y la pregunta va al final
+    messages = prepare_document_messages(doc_content)
+    messages.append({
+        "role": "user",
+        "content": (
+            f"La pregunta del usuario es: {user_input}\n\n"
+            "Responde usando ÚNICAMENTE la información proporcionada en el documento anterior."
+        )
+    })
     
     # Debug info
     if st.session_state.debug_mode:
@@ -182,7 +186,23 @@ Responde usando ÚNICAMENTE la información proporcionada en el documento anteri
         st.write(f"- Primeros 500 caracteres del documento:")
         st.code(doc_content[:500] + "...")
     
-    generate_response(messages, openai_service)
+    generate_response(messages, openai_service, cache_key=st.session_state.active_doc)
+
+def prepare_document_messages(doc_content):
+    """Prepara el prefijo estable (instrucciones + documento) de los mensajes en modo NO_RAG"""
+    return [
+        {
+            "role": "system",
+            "content": NO_RAG_SYSTEM_MESSAGE
+        },
+        {
+            "role": "system",
+            "content": (
+                "A continuación está el contenido completo del documento:\n\n"
+                f"---INICIO DEL DOCUMENTO---\n{doc_content}\n---FIN DEL DOCUMENTO---"
+            )
+        }
+    ]
 
 def prepare_chat_messages(context):
     """Prepara los mensajes para el modelo de chat en modo RAG"""
@@ -198,25 +218,49 @@ def prepare_chat_messages(context):
         }
     ]
     
-    # Agregar historial de conversación
-    for msg in st.session_state.messages:
-        messages.append({"role": msg["role"], "content": msg["content"]})
+    # Agregar historial de conversación (resumen de lo antiguo + mensajes recientes)
+    messages.extend(get_history_messages())
     
     return messages
 
-def generate_response(messages, openai_service):
+def generate_response(messages, openai_service, cache_key=None):
     """Genera y muestra la respuesta del asistente"""
     with st.chat_message("assistant"):
         with st.spinner('Pensando...'):
-            assistant_response = openai_service.get_chat_completion(messages)
+            assistant_response, usage = openai_service.get_chat_completion_with_usage(messages)
             if assistant_response:
                 st.write(assistant_response)
+                if cache_key and usage:
+                    record_prompt_cache_usage(cache_key, usage)
                 # Debug info - Tokens en la respuesta
                 if st.session_state.debug_mode:
                     output_tokens = count_tokens(assistant_response)
                     st.caption(f"Tokens en la respuesta: {output_tokens}")
+                    if cache_key and usage and cache_key in st.session_state.prompt_cache_stats:
+                        render_prompt_cache_stats(cache_key, usage)
                 
                 st.session_state.messages.append({
                     "role": "assistant", 
                     "content": assistant_response
-                })
\ No newline at end of file
+                })
+
+def record_prompt_cache_usage(cache_key, usage):
+    """Acumula los tokens de prompt y los servidos desde la caché del proveedor"""
+    stats = st.session_state.prompt_cache_stats.setdefault(
+        cache_key, {'requests': 0, 'cache_hits': 0, 'prompt_tokens': 0, 'cached_tokens': 0}
+    )
+    stats['requests'] += 1
+    stats['prompt_tokens'] += usage['prompt_tokens']
+    stats['cached_tokens'] += usage['cached_tokens']
+    if usage['cached_tokens']:
+        stats['cache_hits'] += 1
+
+def render_prompt_cache_stats(cache_key, usage):
+    """Muestra en modo debug el uso de la caché de prompts para un documento"""
+    stats = st.session_state.prompt_cache_stats[cache_key]
+    ratio = stats['cached_tokens'] / stats['prompt_tokens'] if stats['prompt_tokens'] else 0
+    st.caption(
+        f"Caché de prompt: {usage['cached_tokens']}/{usage['prompt_tokens']} tokens en esta petición · "
+        f"{stats['cache_hits']}/{stats['requests']} peticiones con acierto · "
+        f"{ratio:.0%} de tokens de prompt cacheados en este documento"
+    )
@@ -1,5 +1,12 @@
+import os
 import streamlit as st
-from utils.pdf_processing import extract_text_from_pdf, split_text
+from utils.pdf_processing import spool_uploaded_file, count_pdf_pages, iter_chunk_batches
+from utils.session_state import reset_conversation
+
+# Número de chunks que se vectorizan y suben a Pinecone en cada lote
+EMBED_BATCH_SIZE = 16
+# Número máximo de embeddings que se conservan para el informe de cuantización (modo debug)
+RECALL_SAMPLE_SIZE = 256
 
 def render_document_list(documents, pinecone_service):
     """Renderiza la lista de documentos en el sidebar"""
@@ -15,7 +22,8 @@ def render_document_list(documents, pinecone_service):
     
     # Subida de documentos
     uploaded_file = st.sidebar.file_uploader("Subir nuevo PDF", type="pdf", key="pdf_uploader")
-    if uploaded_file and uploaded_file.name not in st.session_state.processed_files:
+    # Se identifica cada subida (no cada nombre) para permitir subir versiones revisadas
+    if uploaded_file and uploaded_file.file_id not in st.session_state.processed_uploads:
         if process_uploaded_file(uploaded_file, pinecone_service):
             st.session_state.active_doc = uploaded_file.name
             st.rerun()
@@ -28,38 +36,40 @@ def render_document_list(documents, pinecone_service):
         st.sidebar.info("No hay documentos disponibles")
 
 def process_uploaded_file(uploaded_file, pinecone_service):
-    """Procesa un archivo PDF recién subido"""
+    """Procesa un archivo PDF recién subido (o una nueva versión de uno existente)"""
+    ruta_archivo = None
     try:
         with st.sidebar.status(f'Procesando {uploaded_file.name}...'):
-            if uploaded_file.name in st.session_state.processed_files:
+            if uploaded_file.file_id in st.session_state.processed_uploads:
                 st.sidebar.info(f"{uploaded_file.name} ya está procesado")
                 return True
 
-            # Extraer texto
-            pdf_text = extract_text_from_pdf(uploaded_file)
+            # Volcar el PDF a un archivo temporal propio y leerlo desde allí página a página
+            ruta_archivo = spool_uploaded_file(uploaded_file)
+            num_pages = count_pdf_pages(ruta_archivo)
             
             # Debug info
             if st.session_state.debug_mode:
-                st.sidebar.write(f"Longitud del texto extraído: {len(pdf_text)} caracteres")
-            
-            # Procesar el texto para RAG
-            text_chunks = split_text(pdf_text)
-            embeddings = []
-            for chunk in text_chunks:
-                embedding = st.session_state.openai_service.get_embedding(chunk)
-                if embedding:
-                    embeddings.append(embedding)
+                st.sidebar.write(f"Páginas del documento: {num_pages}")
             
-            # Almacenar en Pinecone (tanto para RAG como para NO-RAG)
-            if pinecone_service.store_document(
+            # Almacenar en Pinecone (tanto para RAG como para NO-RAG) lote a lote;
+            # si el documento ya existe solo se vectorizan los chunks modificados
+            embed_stats = {'embedded_chunks': 0, 'sample': []}
+            if pinecone_service.store_document_stream(
                 uploaded_file.name,
-                text_chunks,
-                embeddings,
-                full_text=pdf_text  # Incluir texto completo para NO-RAG
+                iter_chunk_batches(ruta_archivo, batch_size=EMBED_BATCH_SIZE),
+                make_chunk_embedder(st.session_state.openai_service, embed_stats),
+                num_pages=num_pages
             ):
-                # Guardar también en session_state para el modo NO-RAG actual
-                st.session_state.document_contents[uploaded_file.name] = pdf_text
-                st.session_state.processed_files.add(uploaded_file.name)
+                if st.session_state.debug_mode:
+                    st.sidebar.write(f"Chunks vectorizados: {embed_stats['embedded_chunks']}")
+                    if embed_stats['sample']:
+                        render_quantization_report(embed_stats['sample'])
+
+                # El texto completo no se guarda en session_state: el modo NO-RAG
+                # lo recupera de Pinecone cuando se necesita (y puede haber cambiado)
+                st.session_state.document_contents.pop(uploaded_file.name, None)
+                st.session_state.processed_uploads.add(uploaded_file.file_id)
                 st.sidebar.success(f"{uploaded_file.name} procesado correctamente")
                 return True
             
@@ -68,6 +78,47 @@ def process_uploaded_file(uploaded_file, pinecone_service):
     except Exception as e:
         st.sidebar.error(f"Error procesando {uploaded_file.name}: {e}")
         return False
+    finally:
+        if ruta_archivo and os.path.exists(ruta_archivo):
+            os.remove(ruta_archivo)
+
+def make_chunk_embedder(openai_service, stats):
+    """Crea la función que vectoriza los chunks que PineconeService marca como modificados"""
+    def embed_chunks(chunks):
+        embeddings = openai_service.get_embeddings(chunks)
+        if embeddings is None:
+            return None
+        
+        stats['embedded_chunks'] += len(chunks)
+        # Conservar una muestra acotada para el informe de cuantización
+        if st.session_state.debug_mode and len(stats['sample']) < RECALL_SAMPLE_SIZE:
+            stats['sample'].extend(embeddings[:RECALL_SAMPLE_SIZE - len(stats['sample'])])
+        return embeddings
+    
+    return embed_chunks
+
+def render_quantization_report(embedding_sample):
+    """Muestra la pérdida de recall y la compresión de cuantizar los embeddings del documento"""
+    # Importación diferida: NumPy solo se carga cuando se pide el informe (modo debug)
+    from utils.embedding_quantization import recall_loss_report
+
+    st.sidebar.write(f"Cuantización de embeddings ({len(embedding_sample)} vectores de muestra):")
+    for dtype in ("float16", "int8"):
+        try:
+            report = recall_loss_report(embedding_sample, dtype=dtype)
+        except ValueError as e:
+            st.sidebar.caption(f"Informe de cuantización no disponible: {e}")
+            return
+        query_source = (
+            "consultas externas" if report['query_source'] == "held_out"
+            else "cada vector como consulta, excluyéndose a sí mismo"
+        )
+        st.sidebar.caption(
+            f"{dtype}: recall@{report['top_k']} {report['recall_at_k']:.4f} "
+            f"({report['num_queries']} consultas: {query_source}) · "
+            f"compresión {report['compression']:.1f}x · "
+            f"error máx {report['max_abs_error']:.5f}"
+        )
 
 def render_document_items(documents, pinecone_service):
     """Renderiza cada item de documento en la lista"""
@@ -110,9 +161,7 @@ def render_delete_confirmation(doc_id, doc_info, pinecone_service):
                 # Limpiar estados
                 if st.session_state.active_doc == doc_id:
                     st.session_state.active_doc = None
-                    st.session_state.messages = []
-                if doc_id in st.session_state.processed_files:
-                    st.session_state.processed_files.remove(doc_id)
+                    reset_conversation()
                 if doc_id in st.session_state.document_contents:
                     del st.session_state.document_contents[doc_id]
                 st.session_state.delete_confirm = None
@@ -130,5 +179,5 @@ def render_document_button(doc_id, doc_info):
     else:
         if st.button(f"📄 {doc_info['title']}", key=f"btn_{doc_id}"):
             st.session_state.active_doc = doc_id
-            st.session_state.messages = []
+            reset_conversation()
             st.rerun()
\ No newline at end of file
@@ -0,0 +1,293 @@
+"""
+Política común de llamadas a APIs externas
+
+Este módulo proporciona la capa de resiliencia que usan OpenAIService y PineconeService:
+1. Plazo máximo por intento y plazo total por llamada
+2. Reintentos con backoff exponencial y jitter ante 429, 5xx, timeouts y errores de conexión
+3. Circuit breakers para dejar de insistir cuando la API está caída (los 429 no los abren)
+4. Peticiones duplicadas opcionales (hedging) para recortar la latencia de cola en consultas
+5. Métricas de llamadas, reintentos, timeouts y hedges
+
+Las funciones que se pasan a `call_with_policy` se ejecutan en un pool de hilos,
+por lo que no deben usar st.*: los servicios siguen mostrando los errores con
+st.error cuando la política se agota.
+"""
+
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+logger = logging.getLogger(__name__)
+
+# Pool compartido por proceso para ejecutar los intentos con plazo
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="client-call")
+# Cada cuánto se comprueba si un intento encolado en el pool ya ha arrancado
+_QUEUE_POLL_INTERVAL = 0.05
+
+# Nombres de excepciones transitorias de los SDKs (openai, pinecone, urllib3, httpx)
+_RETRYABLE_ERROR_NAMES = {
+    'APIConnectionError', 'APITimeoutError', 'RateLimitError', 'InternalServerError',
+    'ConnectionError', 'TimeoutError', 'TimeoutException', 'ProtocolError',
+    'MaxRetryError', 'NewConnectionError', 'ReadTimeoutError', 'ServiceException'
+}
+
+class CallTimeoutError(TimeoutError):
+    """Un intento no terminó dentro de su plazo"""
+
+class CircuitOpenError(RuntimeError):
+    """El circuit breaker del servicio está abierto y la llamada no se intenta"""
+
+class CallPolicy:
+    """Parámetros de plazo, reintentos y hedging de un tipo de llamada"""
+
+    def __init__(self, timeout=30.0, deadline=None, max_retries=3, base_delay=0.5,
+                 max_delay=8.0, hedge_after=None):
+        self.timeout = timeout  # Plazo de cada intento, en segundos
+        self.deadline = deadline if deadline is not None else timeout * (max_retries + 1)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # Si un intento tarda más de `hedge_after` segundos se lanza un duplicado
+        # (solo para llamadas idempotentes, como las consultas)
+        self.hedge_after = hedge_after
+
+    def backoff(self, attempt):
+        """Espera antes del reintento `attempt` (full jitter sobre el backoff exponencial)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+class CircuitBreaker:
+    """Circuit breaker sencillo: se abre tras N fallos transitorios seguidos"""
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def _state(self):
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def allow(self):
+        """
+        Indica si se puede intentar una llamada.
+
+        En half_open solo se deja pasar una llamada de prueba; el resto se rechaza
+        hasta que esa prueba registre un éxito (se cierra) o un fallo (se reabre).
+        """
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "open" or self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                # Abrir (o reabrir tras una prueba fallida en half_open)
+                self._opened_at = time.monotonic()
+                METRICS.increment(self.name, 'circuit_opened')
+                logger.warning("Circuit breaker de %s abierto tras %d fallos", self.name, self._failures)
+
+class ClientMetrics:
+    """Contadores por servicio de llamadas, reintentos, timeouts, fallos y hedges"""
+
+    def __init__(self):
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, counter, amount=1):
+        with self._lock:
+            counters = self._counters.setdefault(name, {})
+            counters[counter] = counters.get(counter, 0) + amount
+
+    def snapshot(self):
+        """Devuelve una copia de los contadores: {servicio: {contador: valor}}"""
+        with self._lock:
+            return {name: dict(counters) for name, counters in self._counters.items()}
+
+METRICS = ClientMetrics()
+
+def is_retryable(error):
+    """
+    Indica si un error es transitorio (429, 5xx, timeout o conexión) y merece reintento.
+
+    Args:
+        error (Exception): Error producido por el SDK.
+
+    Returns:
+        bool: True si la llamada puede reintentarse.
+    """
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, (CallTimeoutError, ConnectionError)):
+        return True
+
+    status = getattr(error, 'status_code', None) or getattr(error, 'status', None)
+    if isinstance(status, int):
+        return status in (408, 429) or status >= 500
+
+    return any(cls.__name__ in _RETRYABLE_ERROR_NAMES for cls in type(error).__mro__)
+
+def _submit(fn):
+    """Envía un intento al pool y devuelve su future y la lista donde se anota su inicio"""
+    started = []
+
+    def run():
+        started.append(time.monotonic())
+        return fn()
+
+    return _executor.submit(run), started
+
+def _run_attempt(fn, timeout, hedge_after, name, deadline):
+    """
+    Ejecuta un intento con plazo y, opcionalmente, un duplicado si tarda demasiado.
+
+    El plazo de cada intento empieza cuando su hilo arranca, no cuando se encola:
+    mientras espera un hilo libre del pool solo le limita el plazo total `deadline`.
+    """
+    futures = [_submit(fn)]
+    hedged = hedge_after is None or hedge_after >= timeout
+    pending = {futures[0][0]}
+    last_error = None
+
+    try:
+        while pending:
+            now = time.monotonic()
+            first_started = futures[0][1][0] if futures[0][1] else None
+            if not hedged and first_started is not None and now - first_started >= hedge_after:
+                METRICS.increment(name, 'hedges')
+                futures.append(_submit(fn))
+                pending.add(futures[-1][0])
+                hedged = True
+
+            # Se espera mientras algún intento siga dentro de su plazo
+            expiries = [
+                started[0] + timeout if started else deadline
+                for future, started in futures if future in pending
+            ]
+            limit = min(max(expiries), deadline)
+            if now >= limit:
+                break
+
+            wake_at = limit
+            if not hedged and first_started is not None:
+                wake_at = min(wake_at, first_started + hedge_after)
+            if any(not started for future, started in futures if future in pending):
+                # Revisar pronto si un intento encolado ya arrancó
+                wake_at = min(wake_at, now + _QUEUE_POLL_INTERVAL)
+
+            done, pending = wait(pending, timeout=wake_at - now, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if len(futures) > 1 and future is futures[1][0]:
+                        METRICS.increment(name, 'hedge_wins')
+                    return future.result()
+                last_error = future.exception()
+    finally:
+        # Los hilos no se pueden interrumpir: se cancelan los intentos que aún no
+        # arrancaron y los que ya corren terminan cuando el SDK agota su timeout
+        for future, _ in futures:
+            future.cancel()
+
+    if pending:
+        raise CallTimeoutError(f"{name}: sin respuesta en {timeout:.1f}s")
+    raise last_error
+
+def is_rate_limited(error):
+    """
+    Indica si un error es un 429: el servicio responde, pero pide reducir el ritmo.
+
+    Args:
+        error (Exception): Error producido por el SDK.
+
+    Returns:
+        bool: True si la API rechazó la llamada por límite de peticiones.
+    """
+    status = getattr(error, 'status_code', None) or getattr(error, 'status', None)
+    if isinstance(status, int):
+        return status == 429
+    return any(cls.__name__ == 'RateLimitError' for cls in type(error).__mro__)
+
+def call_with_policy(name, fn, policy, breaker=None):
+    """
+    Ejecuta `fn()` aplicando plazos, reintentos, circuit breaker y hedging.
+
+    Args:
+        name (str): Nombre del servicio, usado en métricas y logs (p. ej. "openai").
+        fn (callable): Llamada sin argumentos al SDK.
+        policy (CallPolicy): Política a aplicar.
+        breaker (CircuitBreaker, opcional): Circuit breaker del servicio.
+
+    Returns:
+        El resultado de `fn()`.
+
+    Raises:
+        CircuitOpenError: Si el circuit breaker está abierto.
+        CallTimeoutError: Si el último intento superó su plazo.
+        Exception: El último error de `fn()` si no es transitorio o se agotan los reintentos.
+    """
+    deadline = time.monotonic() + policy.deadline
+    attempt = 0
+
+    while True:
+        if breaker is not None and not breaker.allow():
+            METRICS.increment(name, 'rejected')
+            raise CircuitOpenError(f"{name}: circuit breaker abierto")
+
+        METRICS.increment(name, 'calls')
+        try:
+            result = _run_attempt(fn, policy.timeout, policy.hedge_after, name, deadline)
+        except Exception as e:
+            retryable = is_retryable(e)
+            if isinstance(e, CallTimeoutError):
+                METRICS.increment(name, 'timeouts')
+            if breaker is not None:
+                # Un error no transitorio (p. ej. 400) o un 429 es una respuesta del
+                # servicio: no cuenta como fallo y libera la prueba de half_open.
+                # Ante un 429 basta con el backoff; abrir el breaker cortaría también
+                # las llamadas de otros usuarios que comparten el servicio
+                if retryable and not is_rate_limited(e):
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+
+            delay = policy.backoff(attempt)
+            if not retryable or attempt >= policy.max_retries or time.monotonic() + delay >= deadline:
+                METRICS.increment(name, 'failures')
+                raise
+
+            attempt += 1
+            METRICS.increment(name, 'retries')
+            logger.info("Reintentando %s (%d/%d) en %.2fs tras: %s",
+                        name, attempt, policy.max_retries, delay, e)
+            time.sleep(delay)
+            continue
+
+        if breaker is not None:
+            breaker.record_success()
+        return result
@@ -1,35 +1,180 @@
+import base64
+import threading
+from collections import OrderedDict
+
 import streamlit as st
-from openai import AzureOpenAI
+
+from services.client_policy import CallPolicy, CircuitBreaker, call_with_policy
+
+def _decode_embedding(embedding):
+    """Convierte un embedding de la API (base64 o lista de floats) en un vector float32"""
+    import numpy as np
+
+    # Algunos backends ignoran encoding_format y devuelven la lista de floats
+    if isinstance(embedding, str):
+        return np.frombuffer(base64.b64decode(embedding), dtype=np.float32)
+    return np.asarray(embedding, dtype=np.float32)
 
 class OpenAIService:
-    def __init__(self, api_base, api_key, api_version="2023-05-15"):
+    # Política de plazos y reintentos por tipo de llamada
+    POLICIES = {
+        # Embedding de la pregunta: en la ruta del usuario, con hedging para la latencia de cola
+        'query_embedding': CallPolicy(timeout=10.0, max_retries=3, hedge_after=2.0),
+        'embeddings': CallPolicy(timeout=30.0, max_retries=4),
+        'chat': CallPolicy(timeout=60.0, max_retries=2),
+        'summary': CallPolicy(timeout=60.0, max_retries=1),
+    }
+    # Circuit breaker de cada tipo de llamada: las llamadas en la ruta del usuario no
+    # comparten breaker con la ingesta ni con los resúmenes en segundo plano
+    BREAKER_GROUPS = {
+        'query_embedding': 'interactive',
+        'chat': 'interactive',
+        'embeddings': 'background',
+        'summary': 'background',
+    }
+
+    def __init__(self, api_base, api_key, api_version="2024-10-21", embed_model=None,
+                 embedding_cache_size=1024, embedding_cache_dtype="float16", policies=None):
+        # Importación diferida: el SDK de OpenAI solo se carga al crear el servicio
+        from openai import AzureOpenAI
+
+        self.embed_model = embed_model
+        # Los reintentos los gestiona la política común, no el SDK
         self.client = AzureOpenAI(
             azure_endpoint=api_base,
             api_key=api_key,
-            api_version=api_version
+            api_version=api_version,
+            max_retries=0
         )
+        self.policies = {**self.POLICIES, **(policies or {})}
+        self.breakers = {
+            group: CircuitBreaker(f"openai.{group}") for group in set(self.BREAKER_GROUPS.values())
+        }
+        # Caché LRU de embeddings de consultas, almacenados cuantizados.
+        # El servicio se comparte entre sesiones, por eso se protege con un lock
+        self.embedding_cache_size = embedding_cache_size
+        self.embedding_cache_dtype = embedding_cache_dtype
+        self._embedding_cache = OrderedDict()
+        self._embedding_cache_lock = threading.Lock()
 
-    def get_embedding(self, text, model=st.secrets["EMBED_MODEL"]):
+    def _call(self, kind, fn, **kwargs):
+        """Ejecuta una llamada al SDK con la política de su tipo (plazo, reintentos, breaker)"""
+        policy = self.policies[kind]
+        # El timeout del SDK libera el hilo de un intento abandonado por la política
+        return call_with_policy(
+            f"openai.{kind}",
+            lambda: fn(timeout=policy.timeout, **kwargs),
+            policy,
+            self.breakers[self.BREAKER_GROUPS[kind]]
+        )
+
+    def _create_embeddings(self, texts, model, kind='embeddings'):
+        """Llama a la API de embeddings y devuelve una matriz float32 (n, dimension)"""
+        import numpy as np
+
+        # Pedir los vectores en base64 evita construir listas de floats de Python
+        response = self._call(
+            kind,
+            self.client.embeddings.create,
+            input=texts,
+            model=model,
+            encoding_format="base64"
+        )
+        # La API puede devolver los resultados desordenados; se ordenan por índice
+        data = sorted(response.data, key=lambda item: item.index)
+        return np.stack([_decode_embedding(item.embedding) for item in data])
+
+    def get_embedding(self, text, model=None):
         """Genera embeddings para un texto dado"""
+        # Importación diferida: NumPy solo se carga al generar el primer embedding
+        from utils.embedding_quantization import quantize, dequantize
+
+        # El modelo se resuelve al llamar, no al importar el módulo
+        model = model or self.embed_model or st.secrets["EMBED_MODEL"]
+        cache_key = (model, text)
+        with self._embedding_cache_lock:
+            cached = self._embedding_cache.get(cache_key)
+            if cached is not None:
+                self._embedding_cache.move_to_end(cache_key)
+                return dequantize(*cached)
         try:
-            response = self.client.embeddings.create(
-                input=[text],
-                model=model
-            )
-            return response.data[0].embedding
+            embedding = self._create_embeddings([text], model, kind='query_embedding')[0]
         except Exception as e:
             st.error(f"Error generando embedding: {e}")
             return None
 
+        if self.embedding_cache_size:
+            with self._embedding_cache_lock:
+                self._embedding_cache[cache_key] = quantize(embedding, self.embedding_cache_dtype)
+                while len(self._embedding_cache) > self.embedding_cache_size:
+                    self._embedding_cache.popitem(last=False)
+        return embedding
+
+    def get_embeddings(self, texts, model=None):
+        """Genera embeddings para una lista de textos en una sola llamada"""
+        model = model or self.embed_model or st.secrets["EMBED_MODEL"]
+        try:
+            return self._create_embeddings(texts, model)
+        except Exception as e:
+            st.error(f"Error generando embeddings: {e}")
+            return None
+
     def get_chat_completion(self, messages, model="gpt-4o", max_tokens=500):
         """Obtiene una respuesta del modelo de chat"""
+        return self.get_chat_completion_with_usage(messages, model, max_tokens)[0]
+
+    def get_chat_completion_with_usage(self, messages, model="gpt-4o", max_tokens=500):
+        """Obtiene una respuesta del modelo de chat junto con el uso de tokens de la petición"""
         try:
-            response = self.client.chat.completions.create(
+            response = self._call(
+                'chat',
+                self.client.chat.completions.create,
                 model=model,
                 messages=messages,
                 max_tokens=max_tokens
             )
-            return response.choices[0].message.content
+            return response.choices[0].message.content, self._usage_from_response(response)
         except Exception as e:
             st.error(f"Error generando respuesta: {e}")
-            return None
\ No newline at end of file
+            return None, None
+
+    @staticmethod
+    def _usage_from_response(response):
+        """Extrae el uso de tokens, incluidos los servidos desde la caché de prompts"""
+        usage = getattr(response, 'usage', None)
+        if usage is None:
+            return None
+        details = getattr(usage, 'prompt_tokens_details', None)
+        return {
+            'prompt_tokens': usage.prompt_tokens,
+            'completion_tokens': usage.completion_tokens,
+            'cached_tokens': (getattr(details, 'cached_tokens', None) or 0) if details else 0
+        }
+
+    def summarize_conversation(self, summary, messages, model="gpt-4o", max_tokens=300):
+        """
+        Condensa un resumen previo y nuevos mensajes en un único resumen.
+
+        Se ejecuta en un hilo de fondo, por lo que no usa st.*: los errores se propagan
+        al future y los registra quien recoge el resultado.
+        """
+        transcript = "\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+        response = self._call(
+            'summary',
+            self.client.chat.completions.create,
+            model=model,
+            messages=[
+                {
+                    "role": "system",
+                    "content": "Resume de forma concisa la conversación entre un usuario y un asistente "
+                               "sobre un documento. Conserva preguntas, datos concretos y conclusiones "
+                               "que puedan ser necesarios para responder preguntas posteriores."
+                },
+                {
+                    "role": "user",
+                    "content": f"Resumen previo:\n{summary or '(ninguno)'}\n\nNuevos mensajes:\n{transcript}"
+                }
+            ],
+            max_tokens=max_tokens
+        )
+        return response.choices[0].message.content
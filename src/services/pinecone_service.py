@@ -1,11 +1,52 @@
+import hashlib
 import streamlit as st
-from pinecone import Pinecone, ServerlessSpec
 from datetime import datetime
 
+from services.client_policy import CallPolicy, CircuitBreaker, call_with_policy
+
+# Límite de IDs por petición de borrado en Pinecone
+DELETE_BATCH_SIZE = 1000
+# Posiciones antes y después del lote actual cuyos vectores anteriores se conservan
+# para reutilizarlos por hash: cubre páginas insertadas o eliminadas hasta ese desplazamiento
+REUSE_WINDOW = 64
+
+def _content_hash(text):
+    """Hash del contenido de un chunk, para detectar cambios entre versiones"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def _to_values(embedding):
+    """Convierte un embedding (array de NumPy o lista) al formato que espera Pinecone"""
+    return embedding.tolist() if hasattr(embedding, 'tolist') else list(embedding)
+
 class PineconeService:
-    def __init__(self, api_key, index_name="pdf-index"):
+    # Política de plazos y reintentos por tipo de llamada
+    POLICIES = {
+        # Búsqueda semántica: en la ruta del usuario, con hedging para la latencia de cola
+        'query': CallPolicy(timeout=5.0, max_retries=3, hedge_after=0.75),
+        'read': CallPolicy(timeout=15.0, max_retries=3),
+        # upsert/update/delete por ID son idempotentes y se pueden reintentar
+        'write': CallPolicy(timeout=30.0, max_retries=4),
+        'admin': CallPolicy(timeout=60.0, max_retries=2),
+    }
+    # Circuit breaker de cada tipo de llamada: las búsquedas del usuario no comparten
+    # breaker con la ingesta de documentos
+    BREAKER_GROUPS = {
+        'query': 'interactive',
+        'read': 'background',
+        'write': 'background',
+        'admin': 'background',
+    }
+
+    def __init__(self, api_key, index_name="pdf-index", policies=None):
         self.index_name = index_name
+        self.policies = {**self.POLICIES, **(policies or {})}
+        self.breakers = {
+            group: CircuitBreaker(f"pinecone.{group}") for group in set(self.BREAKER_GROUPS.values())
+        }
         try:
+            # Importación diferida: el SDK de Pinecone solo se carga al crear el servicio
+            from pinecone import Pinecone
+
             self.client = Pinecone(api_key=api_key)
             self.index = self._create_or_get_index()
         except Exception as e:
@@ -13,14 +54,32 @@ class PineconeService:
             self.client = None
             self.index = None
 
+    def _call(self, kind, fn, *args, **kwargs):
+        """Ejecuta una llamada al SDK con la política de su tipo (plazo, reintentos, breaker)"""
+        policy = self.policies[kind]
+        if kind != 'admin':
+            # Las operaciones del índice aceptan el timeout HTTP del SDK, que libera el
+            # hilo de un intento abandonado por la política (el plano de control no)
+            kwargs = {**kwargs, '_request_timeout': policy.timeout}
+        return call_with_policy(
+            f"pinecone.{kind}",
+            lambda: fn(*args, **kwargs),
+            policy,
+            self.breakers[self.BREAKER_GROUPS[kind]]
+        )
+
     def _create_or_get_index(self):
         """Crea o obtiene el índice de Pinecone"""
         try:
-            existing_indexes = self.client.list_indexes()
+            from pinecone import ServerlessSpec
+
+            existing_indexes = self._call('admin', self.client.list_indexes)
             existing_index_names = [idx.name for idx in existing_indexes]
             
             if self.index_name not in existing_index_names:
-                self.client.create_index(
+                self._call(
+                    'admin',
+                    self.client.create_index,
                     name=self.index_name,
                     dimension=1536,
                     metric='dotproduct',
@@ -30,76 +89,238 @@ class PineconeService:
                     )
                 )
                 
-            return self.client.Index(self.index_name)
+            return self._call('admin', self.client.Index, self.index_name)
         except Exception as e:
             st.error(f"Error creando/obteniendo índice Pinecone: {e}")
             return None
             
-    def _split_text_for_metadata(self, text, max_chunk_size=30000):
-        """Divide el texto en chunks más pequeños para los metadatos"""
-        return [text[i:i + max_chunk_size] for i in range(0, len(text), max_chunk_size)]
+    def store_document_stream(self, doc_name, batches, embed_fn, num_pages, store_full_text=True,
+                              max_text_chunk_size=30000):
+        """
+        Almacena (o actualiza) un documento en Pinecone a partir de un flujo de lotes.
 
-    def store_document(self, doc_name, chunks, embeddings, full_text=None):
-        """Almacena un documento en Pinecone"""
+        Cada lote es una tupla (chunks, texto_bruto). Si el documento ya existe, se
+        crea una nueva versión: cada chunk lleva el hash de su contenido y, si ese
+        contenido ya estaba en la versión anterior (en la misma posición o desplazado
+        hasta REUSE_WINDOW posiciones), se reutiliza su vector; solo los chunks nuevos
+        o modificados se vectorizan con `embed_fn(textos)`. Cada lote se sube en una
+        única petición y los IDs sobrantes de la versión anterior se eliminan al final.
+        El texto completo para NO-RAG se trocea en un búfer acotado, de modo que nunca
+        se mantiene el documento entero en memoria.
+        """
         try:
             # Namespace para chunks (modo RAG)
             rag_namespace = f"{doc_name}_namespace"
+            previous = self._get_document_version_info(doc_name)
             
             # Metadata común
             doc_metadata = {
                 'document_id': doc_name,
                 'title': doc_name,
                 'upload_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                'num_pages': len(chunks),
-                'type': 'pdf'
+                'num_pages': num_pages,
+                'type': 'pdf',
+                'version': previous['version'] + 1
+            }
+            
+            # Máximo de IDs que pueden existir; se guarda en el chunk 0 antes de escribir
+            # más allá, para que una subida interrumpida no deje IDs sin borrar
+            high_water = {
+                'num_chunks': previous['num_chunks'],
+                'num_full_chunks': previous['num_full_chunks']
             }
             
-            # Almacenar chunks para RAG
-            for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-                chunk_metadata = {
-                    **doc_metadata,
-                    'chunk_text': chunk,
-                    'chunk_index': i
+            chunk_index = 0
+            full_index = 0
+            full_buffer = ''
+            first_embedding = None
+            # Vectores de la versión anterior por hash: {hash: (posición, valores)}
+            previous_vectors = {}
+            fetched_until = 0
+            
+            for chunks, raw_text in batches:
+                batch_end = chunk_index + len(chunks)
+                ids = [f"{doc_name}_chunk_{i}" for i in range(chunk_index, batch_end)]
+                hashes = [_content_hash(chunk) for chunk in chunks]
+                
+                # Leer los vectores anteriores hasta REUSE_WINDOW posiciones por delante
+                # antes de sobrescribirlos, y olvidar los que quedan demasiado atrás
+                fetch_until = min(batch_end + REUSE_WINDOW, previous['num_chunks'])
+                if fetch_until > fetched_until:
+                    previous_vectors.update(self._fetch_vectors_by_hash(doc_name, fetched_until, fetch_until))
+                    fetched_until = fetch_until
+                previous_vectors = {
+                    content_hash: vector for content_hash, vector in previous_vectors.items()
+                    if vector[0] >= chunk_index - REUSE_WINDOW
                 }
                 
-                self.index.upsert(
-                    vectors=[(
-                        f"{doc_name}_chunk_{i}",
-                        embedding,
-                        chunk_metadata
-                    )],
-                    namespace=rag_namespace
-                )
-            
-            # Si se proporciona el texto completo, almacenarlo en chunks para NO-RAG
-            if full_text is not None:
-                norag_namespace = f"{doc_name}_full_namespace"
-                text_chunks = self._split_text_for_metadata(full_text)
+                # Vectorizar solo los chunks cuyo contenido no existía
+                changed = [position for position, content_hash in enumerate(hashes)
+                           if content_hash not in previous_vectors]
+                new_embeddings = {}
+                if changed:
+                    embeddings = embed_fn([chunks[position] for position in changed])
+                    # Un embedding perdido desalinearía chunks y vectores: se aborta
+                    if embeddings is None or len(embeddings) != len(changed):
+                        raise ValueError(f"No se pudieron generar los embeddings de {len(changed)} chunks")
+                    new_embeddings = dict(zip(changed, embeddings))
                 
-                # Almacenar cada chunk del texto completo
-                for i, text_chunk in enumerate(text_chunks):
+                vectors = []
+                for position, (id_, chunk, content_hash) in enumerate(zip(ids, chunks, hashes)):
+                    if position in new_embeddings:
+                        values = _to_values(new_embeddings[position])
+                    else:
+                        values = previous_vectors[content_hash][1]
                     chunk_metadata = {
                         **doc_metadata,
-                        'full_text_chunk': text_chunk,
-                        'chunk_index': i,
-                        'total_chunks': len(text_chunks)
+                        'chunk_text': chunk,
+                        'chunk_index': chunk_index + position,
+                        'content_hash': content_hash
                     }
-                    
-                    # Usar el primer embedding como representativo
-                    self.index.upsert(
-                        vectors=[(
-                            f"{doc_name}_full_{i}",
-                            embeddings[0],  # Usamos el primer embedding
-                            chunk_metadata
-                        )],
-                        namespace=norag_namespace
-                    )
+                    if chunk_index + position == 0:
+                        high_water['num_chunks'] = max(high_water['num_chunks'], batch_end)
+                        chunk_metadata.update(high_water)
+                    vectors.append((id_, values, chunk_metadata))
+                
+                if chunk_index > 0:
+                    self._raise_high_water(doc_name, high_water, 'num_chunks', batch_end)
+                self._call('write', self.index.upsert, vectors=vectors, namespace=rag_namespace)
+                if first_embedding is None:
+                    first_embedding = vectors[0][1]
+                
+                chunk_index = batch_end
+                
+                if not store_full_text:
+                    continue
+                
+                # Trocear el texto completo a medida que llega; el último trozo se
+                # retiene hasta el final para poder marcar el total de trozos
+                full_buffer += raw_text
+                text_chunks = []
+                while len(full_buffer) > max_text_chunk_size:
+                    text_chunks.append(full_buffer[:max_text_chunk_size])
+                    full_buffer = full_buffer[max_text_chunk_size:]
+                self._raise_high_water(doc_name, high_water, 'num_full_chunks', full_index + len(text_chunks))
+                full_index = self._upsert_full_text_chunks(
+                    doc_name, text_chunks, full_index, first_embedding, doc_metadata
+                )
+            
+            if store_full_text and full_buffer:
+                self._raise_high_water(doc_name, high_water, 'num_full_chunks', full_index + 1)
+                full_index = self._upsert_full_text_chunks(
+                    doc_name, [full_buffer], full_index, first_embedding, doc_metadata,
+                    total_chunks=full_index + 1
+                )
+            
+            # Eliminar selectivamente los IDs que la nueva versión ya no usa
+            self._delete_ids(
+                [f"{doc_name}_chunk_{i}" for i in range(chunk_index, high_water['num_chunks'])],
+                rag_namespace
+            )
+            if store_full_text:
+                self._delete_ids(
+                    [f"{doc_name}_full_{i}" for i in range(full_index, high_water['num_full_chunks'])],
+                    f"{doc_name}_full_namespace"
+                )
+            
+            # El primer chunk guarda el tamaño real de la versión para la próxima actualización
+            if chunk_index:
+                self._call(
+                    'write',
+                    self.index.update,
+                    id=f"{doc_name}_chunk_0",
+                    set_metadata={
+                        'num_chunks': chunk_index,
+                        'num_full_chunks': full_index if store_full_text else high_water['num_full_chunks']
+                    },
+                    namespace=rag_namespace
+                )
             
             return True
         except Exception as e:
             st.error(f"Error almacenando documento: {e}")
             return False
 
+    def _fetch_vectors_by_hash(self, doc_name, start, end):
+        """Recupera los chunks [start, end) de la versión anterior indexados por hash"""
+        ids = [f"{doc_name}_chunk_{i}" for i in range(start, end)]
+        if not ids:
+            return {}
+        
+        vectors = self._call('read', self.index.fetch, ids=ids, namespace=f"{doc_name}_namespace").vectors
+        by_hash = {}
+        for vector in vectors.values():
+            metadata = vector.metadata or {}
+            # Los chunks anteriores al versionado no tienen hash y se vuelven a vectorizar
+            if metadata.get('content_hash'):
+                by_hash[metadata['content_hash']] = (int(metadata.get('chunk_index', start)), list(vector.values))
+        return by_hash
+
+    def _raise_high_water(self, doc_name, high_water, key, value):
+        """Anota en el chunk 0 que pueden existir IDs hasta `value` antes de escribirlos"""
+        if value <= high_water[key]:
+            return
+        self._call(
+            'write',
+            self.index.update,
+            id=f"{doc_name}_chunk_0",
+            set_metadata={key: value},
+            namespace=f"{doc_name}_namespace"
+        )
+        high_water[key] = value
+
+    def _upsert_full_text_chunks(self, doc_name, text_chunks, start_index, embedding,
+                                 doc_metadata, total_chunks=None):
+        """Almacena trozos del texto completo (NO-RAG) y devuelve el siguiente índice"""
+        if not text_chunks:
+            return start_index
+        
+        vectors = []
+        for i, text_chunk in enumerate(text_chunks, start=start_index):
+            chunk_metadata = {
+                **doc_metadata,
+                'full_text_chunk': text_chunk,
+                'chunk_index': i
+            }
+            # Solo el último trozo conoce el total
+            if total_chunks is not None:
+                chunk_metadata['total_chunks'] = total_chunks
+            
+            # Usar el primer embedding como representativo
+            vectors.append((f"{doc_name}_full_{i}", embedding, chunk_metadata))
+        
+        self._call('write', self.index.upsert, vectors=vectors, namespace=f"{doc_name}_full_namespace")
+        return start_index + len(text_chunks)
+
+    def _get_document_version_info(self, doc_name):
+        """Obtiene la versión y el número de chunks almacenados de un documento"""
+        info = {'version': 0, 'num_chunks': 0, 'num_full_chunks': 0}
+        
+        rag_namespace = f"{doc_name}_namespace"
+        norag_namespace = f"{doc_name}_full_namespace"
+        namespaces = self._call('read', self.index.describe_index_stats).namespaces
+        if rag_namespace not in namespaces:
+            return info
+        
+        first_id = f"{doc_name}_chunk_0"
+        first = self._call('read', self.index.fetch, ids=[first_id], namespace=rag_namespace).vectors.get(first_id)
+        metadata = (first.metadata or {}) if first is not None else {}
+        
+        # Los documentos anteriores al versionado no guardan estos campos:
+        # se usa el número de vectores de cada namespace
+        info['version'] = int(metadata.get('version', 1))
+        info['num_chunks'] = int(metadata.get('num_chunks', namespaces[rag_namespace].vector_count))
+        if 'num_full_chunks' in metadata:
+            info['num_full_chunks'] = int(metadata['num_full_chunks'])
+        elif norag_namespace in namespaces:
+            info['num_full_chunks'] = namespaces[norag_namespace].vector_count
+        return info
+
+    def _delete_ids(self, ids, namespace):
+        """Elimina una lista de IDs de un namespace, por lotes"""
+        for i in range(0, len(ids), DELETE_BATCH_SIZE):
+            self._call('write', self.index.delete, ids=ids[i:i + DELETE_BATCH_SIZE], namespace=namespace)
+
     def get_full_document_text(self, doc_id):
         """Recupera el texto completo de un documento"""
         try:
@@ -109,7 +330,9 @@ class PineconeService:
             vector_dummy = [0.0] * 1536
             
             # Obtener todos los chunks
-            response = self.index.query(
+            response = self._call(
+                'read',
+                self.index.query,
                 vector=vector_dummy,
                 top_k=1000,  # Un número suficientemente grande para obtener todos los chunks
                 namespace=norag_namespace,
@@ -128,7 +351,9 @@ class PineconeService:
                     metadata = match.metadata
                     chunk_index = metadata.get('chunk_index')
                     chunk_text = metadata.get('full_text_chunk', '')
-                    total_chunks = metadata.get('total_chunks')
+                    # En subidas por streaming solo el último trozo guarda el total
+                    if metadata.get('total_chunks') is not None:
+                        total_chunks = metadata.get('total_chunks')
                     
                     if chunk_index is not None and chunk_text:
                         chunks.append((chunk_index, chunk_text))
@@ -149,8 +374,10 @@ class PineconeService:
     def query_document(self, query_embedding, namespace, top_k=3):
         """Realiza una consulta en Pinecone"""
         try:
-            return self.index.query(
-                vector=query_embedding,
+            return self._call(
+                'query',
+                self.index.query,
+                vector=_to_values(query_embedding),
                 top_k=top_k,
                 include_metadata=True,
                 namespace=namespace
@@ -163,11 +390,11 @@ class PineconeService:
         """Elimina todas las versiones de un documento de Pinecone"""
         try:
             # Eliminar namespace RAG
-            self.index.delete(namespace=namespace, deleteAll=True)
+            self._call('write', self.index.delete, namespace=namespace, deleteAll=True)
             
             # Eliminar namespace NO-RAG
             norag_namespace = f"{doc_id}_full_namespace"
-            self.index.delete(namespace=norag_namespace, deleteAll=True)
+            self._call('write', self.index.delete, namespace=norag_namespace, deleteAll=True)
             
             return True
         except Exception as e:
@@ -178,7 +405,7 @@ class PineconeService:
         """Obtiene la lista de documentos disponibles"""
         try:
             # Obtener lista de namespaces
-            stats = self.index.describe_index_stats()
+            stats = self._call('read', self.index.describe_index_stats)
             namespaces = stats.namespaces
 
             documents = {}
@@ -187,7 +414,9 @@ class PineconeService:
                 if not namespace.endswith('_full_namespace'):
                     doc_name = namespace.replace('_namespace', '')
                     vector_dummy = [0.0] * 1536
-                    response = self.index.query(
+                    response = self._call(
+                        'read',
+                        self.index.query,
                         vector=vector_dummy,
                         top_k=1,
                         namespace=namespace,
@@ -200,6 +429,7 @@ class PineconeService:
                             'title': metadata.get('title', doc_name),
                             'upload_date': metadata.get('upload_date', 'Desconocido'),
                             'num_pages': metadata.get('num_pages', 'Desconocido'),
+                            'version': int(metadata.get('version', 1)),
                             'namespace': namespace
                         }
             
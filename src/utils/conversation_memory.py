@@ -0,0 +1,108 @@
+"""
+Memoria de Conversación con Resumen Incremental
+
+Este módulo mantiene acotado el historial que se envía al modelo en cada turno:
+1. Los últimos mensajes se envían literalmente
+2. Los mensajes más antiguos se comprimen en un resumen acumulado
+3. El resumen se genera en segundo plano tras cada respuesta y se guarda en
+   st.session_state, por lo que se reutiliza entre reruns
+
+El hilo de fondo nunca accede a st.session_state: su resultado se recoge en el
+siguiente rerun de la sesión que lo lanzó.
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import streamlit as st
+
+logger = logging.getLogger(__name__)
+
+# Número de mensajes recientes que siempre se envían literalmente
+KEEP_RECENT_MESSAGES = 6
+# Mensajes antiguos que deben acumularse antes de lanzar un nuevo resumen
+SUMMARY_BATCH_MESSAGES = 4
+
+# Un único pool por proceso, compartido por todas las sesiones
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="conversation-summary")
+
+def collect_summary():
+    """
+    Incorpora al estado de la sesión el resumen generado en segundo plano, si ya terminó.
+
+    Notas:
+    - Se descarta el resultado si la conversación cambió mientras se generaba
+    """
+    job = st.session_state.summary_job
+    if job is None or not job['future'].done():
+        return
+
+    st.session_state.summary_job = None
+    if job['doc'] != st.session_state.active_doc or job['until'] > len(st.session_state.messages):
+        return
+
+    try:
+        summary = job['future'].result()
+    except Exception as e:
+        # Sin resumen nuevo se siguen enviando los mensajes literales
+        logger.warning("Error resumiendo la conversación: %s", e)
+        return
+
+    if summary:
+        st.session_state.conversation_summary = summary
+        st.session_state.summarized_messages = job['until']
+
+def get_history_messages():
+    """
+    Devuelve el historial a enviar al modelo: el resumen acumulado más los mensajes recientes.
+
+    Returns:
+        list: Mensajes en formato de la API de chat.
+    """
+    collect_summary()
+
+    history = []
+    if st.session_state.conversation_summary:
+        history.append({
+            "role": "system",
+            "content": f"Resumen de la conversación anterior: {st.session_state.conversation_summary}"
+        })
+
+    # Los mensajes aún no resumidos se envían literalmente
+    for msg in st.session_state.messages[st.session_state.summarized_messages:]:
+        history.append({"role": msg["role"], "content": msg["content"]})
+
+    return history
+
+def schedule_summary_update(openai_service):
+    """
+    Lanza en segundo plano la compresión de los mensajes que ya no son recientes.
+
+    Args:
+        openai_service (OpenAIService): Servicio usado para generar el resumen.
+
+    Notas:
+    - Solo hay un resumen en curso por sesión
+    - Solo se resume cuando se han acumulado al menos SUMMARY_BATCH_MESSAGES mensajes
+      fuera de la ventana reciente, para no pagar una llamada por turno
+    """
+    collect_summary()
+    if st.session_state.summary_job is not None:
+        return
+
+    until = len(st.session_state.messages) - KEEP_RECENT_MESSAGES
+    if until - st.session_state.summarized_messages < SUMMARY_BATCH_MESSAGES:
+        return
+
+    pending = [
+        {"role": msg["role"], "content": msg["content"]}
+        for msg in st.session_state.messages[st.session_state.summarized_messages:until]
+    ]
+    st.session_state.summary_job = {
+        'future': _executor.submit(
+            openai_service.summarize_conversation,
+            st.session_state.conversation_summary,
+            pending
+        ),
+        'doc': st.session_state.active_doc,
+        'until': until
+    }
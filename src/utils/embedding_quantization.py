@@ -0,0 +1,204 @@
+"""
+Utilidad de Cuantización de Embeddings
+
+Este módulo proporciona funciones para:
+1. Cuantizar embeddings float32 a float16 o int8 (escalar, con una escala por vector)
+2. Recuperar embeddings float32 aproximados a partir de su versión cuantizada
+3. Guardar y cargar embeddings cuantizados en disco
+4. Medir la pérdida de recall introducida por la cuantización
+
+Los embeddings se representan siempre como arrays contiguos de NumPy con forma
+(n, dimension). Un embedding de 1536 dimensiones ocupa 6 KB en float32, 3 KB en
+float16 y ~1.5 KB en int8, frente a ~50 KB como lista de floats de Python.
+
+Dependencias:
+- numpy: Para la representación y operaciones sobre los vectores
+"""
+
+import numpy as np
+
+# Tipos de cuantización soportados
+DTYPES = ("float32", "float16", "int8")
+
+def as_embedding_array(embeddings):
+    """
+    Convierte uno o varios embeddings en un array float32 contiguo.
+
+    Args:
+        embeddings (array o lista): Un vector (dimension,) o una matriz (n, dimension).
+
+    Returns:
+        np.ndarray: Array float32 C-contiguo con la misma forma.
+    """
+    return np.ascontiguousarray(embeddings, dtype=np.float32)
+
+def quantize(embeddings, dtype="float16"):
+    """
+    Cuantiza embeddings float32 al tipo indicado.
+
+    Args:
+        embeddings (np.ndarray): Matriz (n, dimension) o vector (dimension,).
+        dtype (str, opcional): "float32", "float16" o "int8". Por defecto "float16".
+
+    Returns:
+        tuple: (codigos, escalas). `escalas` es None salvo para int8, donde contiene
+               un factor float32 por vector (valor absoluto máximo / 127).
+
+    Notas:
+    - int8 usa cuantización escalar simétrica por vector, adecuada para embeddings
+      de OpenAI cuyos componentes están centrados en cero
+    """
+    if dtype not in DTYPES:
+        raise ValueError(f"Tipo de cuantización no soportado: {dtype}")
+
+    vectores = as_embedding_array(embeddings)
+    if dtype == "float32":
+        return vectores, None
+    if dtype == "float16":
+        return vectores.astype(np.float16), None
+
+    # int8: una escala por vector para aprovechar todo el rango [-127, 127]
+    escalas = np.abs(vectores).max(axis=-1, keepdims=True) / 127.0
+    escalas[escalas == 0] = 1.0
+    codigos = np.clip(np.rint(vectores / escalas), -127, 127).astype(np.int8)
+    return codigos, escalas.astype(np.float32)
+
+def dequantize(codigos, escalas=None):
+    """
+    Reconstruye embeddings float32 aproximados a partir de su versión cuantizada.
+
+    Args:
+        codigos (np.ndarray): Resultado de `quantize`.
+        escalas (np.ndarray, opcional): Escalas por vector (solo int8).
+
+    Returns:
+        np.ndarray: Embeddings float32.
+    """
+    vectores = codigos.astype(np.float32)
+    if escalas is not None:
+        vectores *= escalas
+    return vectores
+
+def save_embeddings(ruta_archivo, embeddings, dtype="float16"):
+    """
+    Guarda embeddings en disco en formato .npz, cuantizados al tipo indicado.
+
+    Args:
+        ruta_archivo (str): Ruta del archivo de destino.
+        embeddings (np.ndarray): Matriz (n, dimension) de embeddings.
+        dtype (str, opcional): Tipo de cuantización. Por defecto "float16".
+    """
+    codigos, escalas = quantize(embeddings, dtype)
+    if escalas is None:
+        np.savez(ruta_archivo, codigos=codigos)
+    else:
+        np.savez(ruta_archivo, codigos=codigos, escalas=escalas)
+
+def load_embeddings(ruta_archivo):
+    """
+    Carga embeddings guardados con `save_embeddings`.
+
+    Args:
+        ruta_archivo (str): Ruta del archivo .npz.
+
+    Returns:
+        np.ndarray: Embeddings float32.
+    """
+    with np.load(ruta_archivo) as datos:
+        escalas = datos["escalas"] if "escalas" in datos.files else None
+        return dequantize(datos["codigos"], escalas)
+
+def recall_loss_report(embeddings, dtype="int8", queries=None, top_k=3, max_queries=256):
+    """
+    Mide cuánto cambia la búsqueda top-k al cuantizar los embeddings.
+
+    Args:
+        embeddings (np.ndarray): Matriz (n, dimension) de embeddings de referencia.
+        dtype (str, opcional): Tipo de cuantización a evaluar.
+        queries (np.ndarray, opcional): Consultas externas al índice. Si no se indican,
+                                        cada embedding se usa como consulta excluyendo
+                                        su propio vector de los resultados.
+        top_k (int, opcional): Número de resultados comparados. Por defecto 3, igual
+                               que la búsqueda del modo RAG.
+        max_queries (int, opcional): Número máximo de consultas evaluadas.
+
+    Returns:
+        dict: Con las claves `dtype`, `query_source` ("held_out" o "self_excluded"),
+              `num_queries`, `top_k`, `recall_at_k` (fracción de los top-k exactos que
+              se conservan), `recall_loss`, `max_abs_error`, `bytes_float32`,
+              `bytes_quantized` y `compression`.
+
+    Raises:
+        ValueError: Si no hay más candidatos que `top_k`, porque el recall sería 1.0
+                    por construcción.
+
+    Notas:
+    - La similitud es el producto escalar, la métrica del índice de Pinecone
+    """
+    vectores = as_embedding_array(embeddings)
+    if vectores.ndim != 2 or len(vectores) == 0:
+        raise ValueError("Se necesita una matriz (n, dimension) no vacía")
+
+    autoconsulta = queries is None
+    # Con autoconsultas el propio vector no cuenta como candidato
+    candidatos = len(vectores) - 1 if autoconsulta else len(vectores)
+    if candidatos <= top_k:
+        raise ValueError(
+            f"Se necesitan más de {top_k} candidatos para medir recall@{top_k} "
+            f"(hay {candidatos})"
+        )
+
+    codigos, escalas = quantize(vectores, dtype)
+    aproximados = dequantize(codigos, escalas)
+
+    consultas = vectores if autoconsulta else as_embedding_array(queries)
+    consultas = consultas[:max_queries]
+
+    puntuaciones_exactas = consultas @ vectores.T
+    puntuaciones_cuantizadas = consultas @ aproximados.T
+    if autoconsulta:
+        # Excluir la coincidencia de cada consulta consigo misma
+        filas = np.arange(len(consultas))
+        puntuaciones_exactas[filas, filas] = -np.inf
+        puntuaciones_cuantizadas[filas, filas] = -np.inf
+
+    # Top-k exacto frente a top-k con los vectores cuantizados
+    exactos = np.argsort(-puntuaciones_exactas, axis=1)[:, :top_k]
+    cuantizados = np.argsort(-puntuaciones_cuantizadas, axis=1)[:, :top_k]
+    aciertos = sum(
+        len(np.intersect1d(fila_exacta, fila_cuantizada))
+        for fila_exacta, fila_cuantizada in zip(exactos, cuantizados)
+    )
+    recall = aciertos / (len(consultas) * top_k)
+
+    bytes_cuantizados = codigos.nbytes + (escalas.nbytes if escalas is not None else 0)
+    return {
+        "dtype": dtype,
+        "query_source": "self_excluded" if autoconsulta else "held_out",
+        "num_queries": len(consultas),
+        "top_k": top_k,
+        "recall_at_k": recall,
+        "recall_loss": 1.0 - recall,
+        "max_abs_error": float(np.abs(vectores - aproximados).max()),
+        "bytes_float32": vectores.nbytes,
+        "bytes_quantized": bytes_cuantizados,
+        "compression": vectores.nbytes / bytes_cuantizados,
+    }
+
+# Ejemplo de uso
+if __name__ == "__main__":
+    # Embeddings sintéticos normalizados con la dimensión de text-embedding-ada-002
+    generador = np.random.default_rng(0)
+    muestra = generador.standard_normal((2000, 1536)).astype(np.float32)
+    muestra /= np.linalg.norm(muestra, axis=1, keepdims=True)
+
+    consultas = generador.standard_normal((200, 1536)).astype(np.float32)
+    consultas /= np.linalg.norm(consultas, axis=1, keepdims=True)
+
+    for tipo in ("float16", "int8"):
+        informe = recall_loss_report(muestra, dtype=tipo, queries=consultas)
+        print(
+            f"{tipo}: recall@3={informe['recall_at_k']:.4f} "
+            f"compresión={informe['compression']:.1f}x "
+            f"error máx={informe['max_abs_error']:.5f}"
+        )
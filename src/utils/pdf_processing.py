@@ -6,16 +6,19 @@ Este módulo proporciona funciones para:
 2. Guardar archivos subidos
 3. Procesar archivos PDF
 4. Dividir textos largos en fragmentos manejables
+5. Recorrer PDFs guardados en disco página a página, en lotes de tamaño acotado
 
 Dependencias:
 - PyMuPDF (fitz): Para extracción de texto de PDF
 - tiktoken: Para dividir texto basado en tokens
-- os: Para operaciones de rutas y directorios
+- os / tempfile: Para operaciones de rutas, directorios y archivos temporales
+
+PyMuPDF y tiktoken se importan de forma diferida dentro de cada función para
+no penalizar el arranque de la aplicación hasta que se procesa un PDF.
 """
 
 import os
-import fitz  # Biblioteca PyMuPDF para procesamiento de PDFs
-import tiktoken  # Biblioteca de tokenización de OpenAI
+import tempfile
 
 def extract_text_from_pdf(archivo_subido):
     """
@@ -32,6 +35,8 @@ def extract_text_from_pdf(archivo_subido):
     - Soporta lectura directa desde objetos de archivo
     - Extrae texto de cada página y lo concatena
     """
+    import fitz  # Biblioteca PyMuPDF para procesamiento de PDFs
+
     # Inicializar una cadena vacía para almacenar el texto extraído
     texto_pdf = ""
     
@@ -66,11 +71,138 @@ def save_uploaded_file(archivo_subido):
     ruta_archivo = os.path.join("uploads", archivo_subido.name)
     
     # Escribir el contenido del archivo en la ruta especificada
+    # getbuffer() devuelve una vista de memoria, por lo que no se copia el PDF
     with open(ruta_archivo, "wb") as archivo:
         archivo.write(archivo_subido.getbuffer())
     
     return ruta_archivo
 
+def spool_uploaded_file(archivo_subido, directorio="uploads"):
+    """
+    Vuelca el archivo subido a un archivo temporal único para procesarlo desde disco.
+
+    Args:
+        archivo_subido (objeto similar a archivo): El archivo a volcar.
+        directorio (str, opcional): Directorio donde crear el archivo. Por defecto 'uploads'.
+    
+    Returns:
+        str: Ruta del archivo temporal. El llamador debe eliminarlo al terminar.
+
+    Notas:
+    - Cada subida obtiene su propia ruta, por lo que dos sesiones que suben un PDF
+      con el mismo nombre a la vez no se pisan el archivo
+    """
+    os.makedirs(directorio, exist_ok=True)
+    descriptor, ruta_archivo = tempfile.mkstemp(dir=directorio, suffix=".pdf")
+    
+    # getbuffer() devuelve una vista de memoria, por lo que no se copia el PDF
+    with os.fdopen(descriptor, "wb") as archivo:
+        archivo.write(archivo_subido.getbuffer())
+    
+    return ruta_archivo
+
+def count_pdf_pages(ruta_archivo):
+    """
+    Cuenta las páginas de un PDF guardado en disco sin extraer su texto.
+
+    Args:
+        ruta_archivo (str): Ruta del archivo PDF.
+    
+    Returns:
+        int: Número de páginas del PDF.
+    """
+    import fitz
+
+    with fitz.open(ruta_archivo) as doc:
+        return doc.page_count
+
+def iter_pdf_pages(ruta_archivo):
+    """
+    Genera el texto de un PDF guardado en disco página a página.
+
+    Args:
+        ruta_archivo (str): Ruta del archivo PDF.
+    
+    Yields:
+        str: Texto de cada página, en orden.
+
+    Notas:
+    - PyMuPDF abre el archivo desde disco y lee cada página bajo demanda,
+      por lo que el PDF completo nunca se carga como bytes en Python
+    - Solo se mantiene en memoria el texto de la página actual
+    """
+    import fitz
+
+    with fitz.open(ruta_archivo) as doc:
+        for pagina in doc:
+            yield pagina.get_text()
+
+def iter_text_chunks(paginas, max_tokens=8191):
+    """
+    Divide un flujo de páginas en fragmentos de como máximo `max_tokens` tokens.
+
+    Equivalente en streaming de `split_text`, pero los fragmentos nunca cruzan
+    el límite de una página: así, al revisar un documento, un cambio en una
+    página solo altera los fragmentos de esa página.
+
+    Args:
+        paginas (iterable de str): Textos de las páginas, en orden.
+        max_tokens (int, opcional): Número máximo de tokens por fragmento.
+    
+    Yields:
+        tuple: (fragmento, texto_consumido), donde `texto_consumido` es el texto
+               original leído desde el fragmento anterior.
+
+    Notas:
+    - Solo se codifica una página a la vez
+    - Las páginas sin texto no generan fragmentos
+    """
+    import tiktoken
+
+    codificacion = tiktoken.get_encoding("cl100k_base")
+    texto_consumido = []
+
+    for pagina in paginas:
+        texto_consumido.append(pagina)
+        if not pagina.strip():
+            continue
+
+        tokens = codificacion.encode(pagina)
+        for i in range(0, len(tokens), max_tokens):
+            yield codificacion.decode(tokens[i:i + max_tokens]), "".join(texto_consumido)
+            texto_consumido = []
+
+def iter_chunk_batches(ruta_archivo, batch_size=16, max_tokens=8191):
+    """
+    Recorre un PDF guardado en disco y genera lotes de fragmentos de texto.
+
+    Args:
+        ruta_archivo (str): Ruta del archivo PDF.
+        batch_size (int, opcional): Número de fragmentos por lote.
+        max_tokens (int, opcional): Número máximo de tokens por fragmento.
+    
+    Yields:
+        tuple: (fragmentos, texto_bruto), donde `fragmentos` es una lista de como
+               máximo `batch_size` textos y `texto_bruto` el texto original del
+               PDF cubierto por el lote (para el modo NO_RAG).
+
+    Notas:
+    - La memoria usada es proporcional a `batch_size`, no al tamaño del documento
+    """
+    fragmentos = []
+    texto_bruto = []
+
+    for fragmento, texto in iter_text_chunks(iter_pdf_pages(ruta_archivo), max_tokens):
+        fragmentos.append(fragmento)
+        texto_bruto.append(texto)
+        if len(fragmentos) >= batch_size:
+            yield fragmentos, "".join(texto_bruto)
+            fragmentos = []
+            texto_bruto = []
+
+    if fragmentos:
+        yield fragmentos, "".join(texto_bruto)
+
 def process_pdf(archivo_subido):
     """
     Función integral de procesamiento de PDF que:
@@ -108,7 +240,10 @@ def split_text(texto, max_tokens=8191):
     - Límite de tokens por defecto establecido en 8191, compatible con muchas API de LLM
     - Útil para procesar textos largos que exceden las limitaciones de ventana de contexto
     """
+    import tiktoken  # Biblioteca de tokenización de OpenAI
+
     # Obtener el tokenizador base usado por muchos modelos de OpenAI
+    # (tiktoken lo cachea por proceso tras la primera carga)
     codificacion = tiktoken.get_encoding("cl100k_base")
     
     # Codificar todo el texto en tokens
@@ -6,8 +6,8 @@ def init_session_state():
         st.session_state.active_doc = None
     if 'messages' not in st.session_state:
         st.session_state.messages = []
-    if 'processed_files' not in st.session_state:
-        st.session_state.processed_files = set()
+    if 'processed_uploads' not in st.session_state:
+        st.session_state.processed_uploads = set()  # file_id de cada subida ya procesada
     if 'delete_confirm' not in st.session_state:
         st.session_state.delete_confirm = None
     if 'chat_mode' not in st.session_state:
@@ -15,4 +15,19 @@ def init_session_state():
     if 'document_contents' not in st.session_state:
         st.session_state.document_contents = {}  # Para modo NO_RAG
     if 'debug_mode' not in st.session_state:
-        st.session_state.debug_mode = False  # Control del modo debug
\ No newline at end of file
+        st.session_state.debug_mode = False  # Control del modo debug
+    if 'conversation_summary' not in st.session_state:
+        st.session_state.conversation_summary = ""  # Resumen de los mensajes antiguos
+    if 'summarized_messages' not in st.session_state:
+        st.session_state.summarized_messages = 0  # Mensajes ya incluidos en el resumen
+    if 'summary_job' not in st.session_state:
+        st.session_state.summary_job = None  # Resumen en curso en segundo plano
+    if 'prompt_cache_stats' not in st.session_state:
+        st.session_state.prompt_cache_stats = {}  # Aciertos de caché de prompt por documento
+
+def reset_conversation():
+    """Vacía el historial del chat y su resumen"""
+    st.session_state.messages = []
+    st.session_state.conversation_summary = ""
+    st.session_state.summarized_messages = 0
+    st.session_state.summary_job = None
\ No newline at end of file
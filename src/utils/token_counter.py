@@ -1,4 +1,36 @@
-import tiktoken
+from functools import lru_cache
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str = "gpt-4"):
+    """
+    Obtiene (y cachea por proceso) la codificación de tiktoken para un modelo.
+    
+    Args:
+        model: El modelo cuya codificación se quiere obtener
+        
+    Returns:
+        tiktoken.Encoding: La codificación del modelo, o cl100k_base si no se conoce
+    """
+    # Importación diferida: tiktoken solo se carga cuando se necesita contar tokens
+    import tiktoken
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        # Fallback a cl100k_base si el modelo no está disponible
+        return tiktoken.get_encoding("cl100k_base")
+
+def warm_up_encodings(models=("gpt-4",)):
+    """
+    Precarga las codificaciones de tiktoken para que la primera petición no pague su coste.
+    
+    Args:
+        models: Modelos cuyas codificaciones se deben precargar
+    """
+    for model in models:
+        try:
+            get_encoding(model)
+        except Exception as e:
+            print(f"Error precargando codificación para {model}: {e}")
 
 def count_tokens(text: str, model: str = "gpt-4") -> int:
     """
@@ -12,16 +44,10 @@ def count_tokens(text: str, model: str = "gpt-4") -> int:
         int: Número de tokens
     """
     try:
-        encoding = tiktoken.encoding_for_model(model)
-        return len(encoding.encode(text))
-    except Exception:
-        try:
-            # Fallback a cl100k_base si el modelo no está disponible
-            encoding = tiktoken.get_encoding("cl100k_base")
-            return len(encoding.encode(text))
-        except Exception as e:
-            print(f"Error contando tokens: {e}")
-            return 0
+        return len(get_encoding(model).encode(text))
+    except Exception as e:
+        print(f"Error contando tokens: {e}")
+        return 0
 
 def count_messages_tokens(messages: list, model: str = "gpt-4") -> int:
     """